@@ -29,14 +29,16 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 import re
+import array
 import numpy
 from enum import Enum
-from orderedset import OrderedSet
 from os.path import realpath
 
 metrics_names = ["SCORE WIKI",	"SCORE METRICS", "CONFIDENCE"]
 stats_names = ["WIKI BACKLINKS", "WIKI HITS", "WIKI PRIMARY SENSE"]
 all_stats = stats_names + metrics_names
+# metrics computed for each line of KB and normalized into percentiles (see insert_metrics)
+percentile_metrics = ["columns_number", "description_length", "wiki_backlinks", "wiki_hits", "wiki_ps"]
 
 LOCKED_FILE_ERR = "File Acquisition Timeout: Process Exiting with Failure"
 LOCK_TIMEOUT = 600 # 10 minutes
@@ -45,11 +47,38 @@ LOCK_TIMEOUT = 600 # 10 minutes
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 KB_MULTIVALUE_DELIM = "|"
 
+# patterns for parsing columns of HEAD-KB (compiled once for all instances)
+_PARSER_PATTERN = r"""
+    (?:\{(?P<FLAGS>(?:\w|[ ])*)(?:\[(?P<PREFIX_OF_VALUE>[^\]]+)\])?\})?
+    (?P<NAME>(?:\w|[ ])+)
+"""
+
+# (used with fullmatch, so the patterns are anchored at both ends)
+_PARSER_FIRST = re.compile(r"""(?ux)
+    <(?P<TYPE>[^>]+)>
+    (""" + _PARSER_PATTERN + r""")?
+""")
+
+_PARSER_OTHER = re.compile(r"""(?ux)
+    """ + _PARSER_PATTERN + r"""
+""")
+
+# article names in stats files use "_" instead of spaces
+_ART_NAME_TRANS = str.maketrans("_", " ")
+
 class KB_PART(Enum):
     HEAD = 1
     DATA = 2
 
 # FUNCTIONS AND CLASSES
+def _advise_sequential(file):
+    """Hints the OS that the file will be read sequentially (larger readahead), where supported."""
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
 class KnowledgeBase:
     """
     * Pracuje s daty (sloupci) obsaženými na řádku v KB nebo v daném seznamu.
@@ -68,16 +97,34 @@ class KnowledgeBase:
 
         self.version = ""
 
+        # position of the DATA part in the KB file found while reading HEAD-KB, so that load_kb does not read HEAD-KB again
+        self._data_offset = None # tuple(str(PATH), int(MTIME), int(OFFSET))
+
         self.headKB, self.ent_type_col = self.getDictHeadKB(self.path_to_kb)
+        self._type_width = self._count_type_widths() # Slovník TYPE:int(NUMBER_OF_COLUMNS)
 
         self._kb_loaded = False
         self.lines = []
 
-        # lists of metrics values in kb for computing percentiles
-        self.metrics = {} # Slovník repr(set(ENTITY_TYPE_SET)):{str(METRIC):[int(VALUE), ...]}
+        # sorted arrays of metrics values in kb for computing percentiles
+        self.metrics = {} # Slovník frozenset(ENTITY_TYPE_SET):{str(METRIC):ndarray([int(VALUE), ...])}
+
+        # maximal values of metrics (percentile score of a value is its ratio to the maximal value)
+        self.metrics_max = {} # Slovník frozenset(ENTITY_TYPE_SET):{str(METRIC):float(MAX_VALUE)}
+
+        # cache of absolute column numbers for each entity type set (order of types matters here)
+        self._col_for_cache = {} # Slovník tuple(ENTITY_TYPE_SET):{str(COLUMN_NAME):int(COLUMN)}
+        self._metrics_cols_cache = {} # Slovník tuple(ENTITY_TYPE_SET):frozenset(COLUMN, ...), sloupce __stats__
+        self._ent_head_cache = {} # Slovník tuple(ENTITY_TYPE_SET):tuple(COLUMN_NAME, ...)
+
+        # caches of parsed TYPE values and of their indexes into metrics
+        self._ent_type_cache = {} # Slovník str(TYPE):tuple(ENTITY_TYPE_SET)
+        self._ent_type_index_cache = {} # Slovník tuple(ENTITY_TYPE_SET):frozenset(ENTITY_TYPE_SET)
 
-        # data structure for indexing percentile scores
-        self.metric_index = {} # Slovník repr(set(ENTITY_TYPE_SET)):{str(METRIC):{int(VALUE):float(PERCENTILE)}}
+        # values of percentile_metrics for each line of KB (filled in insert_metrics)
+        self._row_type_codes = None # ndarray(int(CODE)), kód frozenset(ENTITY_TYPE_SET) pro každý řádek KB
+        self._row_has_wiki = None # ndarray(bool(WIKI BACKLINKS)) pro každý řádek KB
+        self._row_stats = None # ndarray řádek KB x percentile_metrics
 
         self.multivalue_delim = "|"
         self.type_delim = "+"
@@ -91,40 +138,56 @@ class KnowledgeBase:
         assert isinstance(kb_part, KB_PART)
 
         # Check for empty file
-        if os.stat(fpath).st_size == 0:
+        fstat = os.stat(fpath)
+        if fstat.st_size == 0:
             print("Error: empty KB file")
             exit(1)
 
         lines = []
         data_part = False
+        min_cols_for_type = {} # Slovník str(TYPE):int(MIN_LINE_COLS), počet sloupců závisí jen na typu entity
         with open(fpath) as fd:
             # KB version
             self.version = fd.readline().rstrip()
+
+            # Skip HEAD-KB if the position of DATA is known from reading HEAD-KB earlier
+            if kb_part == KB_PART.DATA and self._data_offset is not None and self._data_offset[:2] == (fpath, fstat.st_mtime_ns):
+                fd.seek(self._data_offset[2])
+                data_part = True
+            elif kb_part == KB_PART.DATA:
+                # Skip HEAD-KB without splitting its lines
+                for line in fd:
+                    if line == "\n":
+                        break
+                data_part = True
             
-            for line_num, line in enumerate(fd):
+            # (readline keeps fd.tell() usable, which is disabled while iterating over fd)
+            for line in (iter(fd.readline, "") if kb_part == KB_PART.HEAD else fd):
                 if line == "\n":
                     if kb_part == KB_PART.HEAD:
+                        self._data_offset = (fpath, fstat.st_mtime_ns, fd.tell())
                         break
                     data_part = True
                 elif line != "":
-                    if not data_part and kb_part == KB_PART.DATA:
-                        continue
                     if data_part:
                         # Add missing line columns
-                        line_split = line.split("\t")
+                        line_split = line.rstrip("\n").split("\t")
                         line_cols = len(line_split)
                         ent_type = line_split[self.ent_type_col]
-                        ent_type = ent_type.split(self.type_delim)
-                        ent_type_set = OrderedSet(ent_type)
-                        
-                        if "__generic__" in self.headKB and "__generic__" not in ent_type_set:
-                            ent_type_set = OrderedSet(["__generic__"]) | ent_type_set
-
-                        min_line_cols = 0                         
-                        for item in ent_type_set:
-                            min_line_cols += sum([1 for attr in self.headKB[item] if attr is not None])
+                        min_line_cols = min_cols_for_type.get(ent_type)
+                        if min_line_cols is None:
+                            ent_type_set = tuple(dict.fromkeys(ent_type.split(self.type_delim))) # ordered set of types
+                            
+                            if "__generic__" in self.headKB and "__generic__" not in ent_type_set:
+                                ent_type_set = ("__generic__",) + ent_type_set
+
+                            min_line_cols = 0                         
+                            for item in ent_type_set:
+                                min_line_cols += self._type_width[item]
+                            min_cols_for_type[ent_type] = min_line_cols
                         # Add missing columns + add columns for possible stats                      
-                        lines.append(line[:-1].split("\t") + ['' for _ in range(min_line_cols - line_cols + len(all_stats))])
+                        line_split.extend([''] * (min_line_cols - line_cols + len(all_stats)))
+                        lines.append(line_split)
                     else:
                         lines.append(line[:-1].split("\t"))
         return lines
@@ -135,25 +198,9 @@ class KnowledgeBase:
         Returns a dictionary with the structure of KB from HEAD-KB and number of column with attribute TYPE.
         """
 
-        PARSER_PATTERN = r"""
-            (?:\{(?P<FLAGS>(?:\w|[ ])*)(?:\[(?P<PREFIX_OF_VALUE>[^\]]+)\])?\})?
-            (?P<NAME>(?:\w|[ ])+)
-        """
-
-        PARSER_FIRST = re.compile(r"""(?ux)
-            ^
-            <(?P<TYPE>[^>]+)>
-            (""" + PARSER_PATTERN + r""")?
-            $
-        """)
-
-        PARSER_OTHER = re.compile(r"""(?ux)
-            ^
-            """ + PARSER_PATTERN + r"""
-            $
-        """)
-
         lines = self.getKBLines(self.path_to_kb, KB_PART.HEAD)
+        # raw lines of HEAD-KB are kept for saving the KB (headKB does not hold flags and prefixes of columns)
+        self._head_lines = lines
 
         headKB = {} # Slovník TYPE:{SUBTYPE:{COLUMN_NAME:COLUMN}}
         ent_type_col = None # Sloupec ve kterém je definován typ entity
@@ -163,12 +210,12 @@ class KnowledgeBase:
             for col_num in range(len(lines[line_num])):
                 plain_column = lines[line_num][col_num]
                 if col_num == 0:
-                    splitted = PARSER_FIRST.search(plain_column)
+                    splitted = _PARSER_FIRST.fullmatch(plain_column)
                     head_type = splitted.group("TYPE")
                     if head_type not in headKB:
                         headKB[head_type] = {}
                 else:
-                    splitted = PARSER_OTHER.search(plain_column)
+                    splitted = _PARSER_OTHER.fullmatch(plain_column)
 
                 if splitted is not None: # This type has no defined columns
                     col_name = splitted.group("NAME")
@@ -202,28 +249,61 @@ class KnowledgeBase:
     def get_ent_head(self, line):
         ent_type_set = self.get_ent_type(line)
 
-        head = []
-        for ent_supertype in ent_type_set:
-            if ent_supertype not in self.headKB:
-                raise Exception(f'Not defined type "{ent_supertype}" in head of KB.')
-            head.extend([item[0] for item in sorted(self.headKB[ent_supertype].items(), key=lambda i: i[-1])])
-        return head
+        head = self._ent_head_cache.get(ent_type_set)
+        if head is None:
+            head = []
+            for ent_supertype in ent_type_set:
+                if ent_supertype not in self.headKB:
+                    raise Exception(f'Not defined type "{ent_supertype}" in head of KB.')
+                head.extend([item[0] for item in sorted(self.headKB[ent_supertype].items(), key=lambda i: i[-1])])
+            head = tuple(head)
+            self._ent_head_cache[ent_type_set] = head
+        return list(head)
+
+
+    def _count_type_widths(self):
+        """ Returns a dictionary with the number of columns of each type in headKB (a type without columns has only a None key). """
+        return {type_name: sum([1 for attr in type_cols if attr is not None]) for type_name, type_cols in self.headKB.items()}
+
+
+    def _clear_head_caches(self):
+        """ Clears all caches derived from headKB (called whenever headKB is changed). """
+        self._type_width = self._count_type_widths()
+        self._ent_type_cache.clear()
+        self._col_for_cache.clear()
+        self._metrics_cols_cache.clear()
+        self._ent_head_cache.clear()
 
 
     def get_ent_type(self, line):
-        """ Returns a set of a type of an entity at the line of the knowledge base. """
-        ent_type = self.get_field(line, self.ent_type_col)
-        ent_type = ent_type.split(self.type_delim)
-        ent_type_set = OrderedSet(ent_type)
-        
-        if "__generic__" in self.headKB and "__generic__" not in ent_type_set:
-            ent_type_set = OrderedSet(["__generic__"]) | ent_type_set
-        if "__stats__" in self.headKB and "__stats__" not in ent_type_set:
-            ent_type_set = ent_type_set | OrderedSet(["__stats__"])
-        
+        """ Returns a set (ordered tuple) of a type of an entity at the line of the knowledge base. """
+        return self._parse_ent_type(self.get_field(line, self.ent_type_col))
+
+
+    def _parse_ent_type(self, ent_type):
+        """ Returns a set (ordered tuple) of a type of an entity for a value of the TYPE column (cached, there are only a few distinct values). """
+        ent_type_set = self._ent_type_cache.get(ent_type)
+        if ent_type_set is None:
+            ent_type_set = tuple(dict.fromkeys(ent_type.split(self.type_delim))) # ordered set of types
+            
+            if "__generic__" in self.headKB and "__generic__" not in ent_type_set:
+                ent_type_set = ("__generic__",) + ent_type_set
+            if "__stats__" in self.headKB and "__stats__" not in ent_type_set:
+                ent_type_set = ent_type_set + ("__stats__",)
+            
+            self._ent_type_cache[ent_type] = ent_type_set
         return ent_type_set
 
 
+    def _ent_type_set_index(self, ent_type_set):
+        """ Returns a key for indexing metrics of the given entity type set (cached). """
+        ent_type_set_index = self._ent_type_index_cache.get(ent_type_set)
+        if ent_type_set_index is None:
+            ent_type_set_index = frozenset(ent_type_set) # using a set for indexing because {1,3,2} == {1,2,3} but (1,3,2) != (1,2,3)
+            self._ent_type_index_cache[ent_type_set] = ent_type_set_index
+        return ent_type_set_index
+
+
     def get_location_code(self, line):
         return self.get_data_for(line, "FEATURE CODE")[0:3]
 
@@ -244,19 +324,31 @@ class KnowledgeBase:
             raise
 
 
+    def _cols_for(self, ent_type_set):
+        """ Returns a dictionary of absolute column numbers of all columns for the given entity type set. """
+
+        ent_type_key = tuple(ent_type_set)
+        cols = self._col_for_cache.get(ent_type_key)
+        if cols is None:
+            cols = {}
+            col = 0
+            for type_name in ent_type_key:
+                for col_name, type_col in self.headKB[type_name].items():
+                    if col_name is not None:
+                        cols.setdefault(col_name, col + int(type_col))
+                col += self._type_width[type_name]
+            self._col_for_cache[ent_type_key] = cols
+        return cols
+
+
     def get_col_for(self, line, col_name, col_name_type=None):
         """ Line numbering from one. """
 
         # getting the entity type
-        ent_type_set = self.get_ent_type(line)
-        col = 0
-        for type_name in ent_type_set:
-            if self.headKB[type_name].get(col_name) is not None:
-                return col + int(self.headKB[type_name][col_name])
-            else:
-                col += sum([1 for attr in self.headKB[type_name] if attr is not None])
-        
-        raise RuntimeError(f"Column name {col_name} does not exist for this line: {line}") 
+        col = self._cols_for(self.get_ent_type(line)).get(col_name)
+        if col is None:
+            raise RuntimeError(f"Column name {col_name} does not exist for this line: {line}") 
+        return col
 
 
     def get_data_for(self, line, col_name, col_name_type=None):
@@ -278,18 +370,17 @@ class KnowledgeBase:
             columns = self.lines[line - 1]
 
         if "__stats__" in self.headKB:
-            metrics_cols = [self.get_col_for(columns, colname, "__stats__") for colname in self.headKB["__stats__"].keys()]
+            ent_type_set = self.get_ent_type(columns)
+            metrics_cols = self._metrics_cols_cache.get(ent_type_set)
+            if metrics_cols is None:
+                metrics_cols = frozenset(self.get_col_for(columns, colname, "__stats__") for colname in self.headKB["__stats__"].keys())
+                self._metrics_cols_cache[ent_type_set] = metrics_cols
         else:
             print("WARNING: No metrics columns was found => it will continue without metrics.", file=sys.stderr, flush=True)
-            metrics_cols = []
+            metrics_cols = frozenset()
         
-        result = 0
-        # KB lines are indexed from one
-        for col in range(len(columns)):
-            if col not in metrics_cols and columns[col]:
-                result += 1
-
-        return result
+        # all non-empty columns except the metrics ones
+        return sum(map(bool, columns)) - sum(1 for col in metrics_cols if col < len(columns) and columns[col])
 
 
     def description_length(self, line):
@@ -298,20 +389,20 @@ class KnowledgeBase:
         return len(self.get_data_for(line, "DESCRIPTION"))
 
     def show_progress(self, val, max, interval=1, message="", end_message=""):
+        # called for every line of KB, so the message is formatted only when it is written
         if val % interval == 0:
-            print(f"{message}\t{round((val/max)*100,1)}%", end="\r")
+            sys.stdout.write(f"{message}\t{round((val/max)*100,1)}%\r")
 
         # Newline after finish
         if val == max:
-            print(f"{message}\t100.0%")
-            print(end_message + (len(message)+5) * " ")
+            sys.stdout.write(f"{message}\t100.0%\n{end_message}{(len(message)+5) * ' '}\n")
 
     def metric_percentile(self, line, metric):
         """ Computing a percentile score for a given metric and entity. """
 
         # getting the entity type
         ent_type_set = self.get_ent_type(line)
-        ent_type_set_index = repr(set(ent_type_set)) # using normal set for indexing because {1,3,2} == {1,2,3} but OrderedSet([1,3,2]) != OrderedSet([1,2,3])
+        ent_type_set_index = self._ent_type_set_index(ent_type_set)
 
         if metric == 'description_length':
             value = self.description_length(line)
@@ -323,7 +414,10 @@ class KnowledgeBase:
                 value = 0
             else:
                 value = int(value_str)
-        return self.metric_index[ent_type_set_index][metric][value]
+        max_value = self.metrics_max[ent_type_set_index][metric]
+        if max_value:
+            return min(value / max_value, 1.0)
+        return 1.0
 
 
     def get_wiki_value(self, line, column_name):
@@ -340,6 +434,18 @@ class KnowledgeBase:
         else:
             return self.get_data_for(line, column_name)
 
+
+    def get_wiki_raw(self, columns, ent_type_set, column_name):
+        """
+        Faster variant of get_wiki_value for hot loops - line is given as a list of columns
+        with already known entity type set and column_name is the full name of the column.
+        """
+
+        val = columns[self._cols_for(ent_type_set)[column_name]]
+        if val == '' or val == 'NF':
+            val = '0'
+        return val
+
     
     def check_all_stats_present(self) -> bool:
         """ Checks if all stats are present in kb head """
@@ -352,7 +458,7 @@ class KnowledgeBase:
         return True
     
     def check_stats_files(self, stats_files:list) -> bool:
-        stats_present = len(stats_names) * [False]
+        stats_present = set()
         # Check stats files
         for file in stats_files:
             if not os.path.exists(file):
@@ -385,15 +491,12 @@ class KnowledgeBase:
                     return False
             
             # Check for all neccessary stats
-            for i, stat in enumerate(stats_names):
-                if stat in STATS_HEAD["__stats__"]:
-                    stats_present[i] = True
+            stats_present.update(set(STATS_HEAD["__stats__"]).intersection(stats_names))
         
-        for check in stats_present:
-            if check is False:
-                print(stats_present)
-                print("Stats files: some/all stats are missing")
-                return False
+        if not stats_present.issuperset(stats_names):
+            print([stat in stats_present for stat in stats_names])
+            print("Stats files: some/all stats are missing")
+            return False
                             
         return True
 
@@ -419,6 +522,7 @@ class KnowledgeBase:
         for metric in metrics_names:
             if metric not in stats.keys():
                 self.headKB["__stats__"][metric] = len(self.headKB["__stats__"])
+                self._clear_head_caches()
         
         return True
     
@@ -441,6 +545,7 @@ class KnowledgeBase:
         
         # Add stats to kb head
         self.headKB['__stats__'] = {}
+        self._clear_head_caches()
         for stat in stats_names:
             self.headKB["__stats__"][stat] = len(self.headKB["__stats__"])
 
@@ -459,6 +564,7 @@ class KnowledgeBase:
         
         # Load pageviews
         with open(realpath(pw_path)) as file_in:
+            _advise_sequential(file_in)
             # Skip head
             while file_in.readline().strip() != "":
                 pass
@@ -473,14 +579,14 @@ class KnowledgeBase:
                 # values[0] ARTICLE_NAME
                 # values[1] PAGEVIEWS (HITS)
 
-                art_name = values[0].replace("_"," ")
-                stats[art_name] = [0, values[1].rstrip(), 0]
+                stats[values[0].translate(_ART_NAME_TRANS)] = [0, values[1].rstrip(), 0]
 
 
         print("Pageviews loaded.")
         
         # Load backlinks, primary sense
         with open(bps_path, "r") as file_in:  
+            _advise_sequential(file_in)
             # Skip head
             while file_in.readline().strip() != "":
                 pass
@@ -496,10 +602,11 @@ class KnowledgeBase:
                 # values[1] BACKLINKS
                 # values[2] PRIMARY_SENSE
 
-                art_name = values[0].replace("_"," ")
-                if art_name in stats:
-                    stats[art_name][0] = values[1] 
-                    stats[art_name][2] = values[2].rstrip()
+                art_name = values[0].translate(_ART_NAME_TRANS)
+                art_stats = stats.get(art_name)
+                if art_stats is not None:
+                    art_stats[0] = values[1]
+                    art_stats[2] = values[2].rstrip()
                 else:
                     stats[art_name] = [values[1], 0, values[2].rstrip()]
 
@@ -507,21 +614,26 @@ class KnowledgeBase:
 
         # Insert stats to KB
         # Add columns for stats
-        for line_num in range(1, len(self.lines) + 1):
+        stats_cols_for_type = {} # Slovník tuple(ENTITY_TYPE_SET):(int(NAME_COLUMN), [(int(STAT_COLUMN), int(STAT_INDEX)), ...])
+        lines_count = len(self.lines)
+        for line_num, columns in enumerate(self.lines, 1):
             self.show_progress(
                 val=line_num,
-                max=len(self.lines),
+                max=lines_count,
                 interval=10000,
                 message="Inserting stats... ",
                 end_message="Stats inserted."
                 )
-            columns = self.lines[line_num - 1]     
-            art_name = columns[self.get_col_for(columns, "NAME")]
-            if stats.get(art_name):
-                val = stats.pop(art_name)
-                for idx, stat in enumerate(stats_names):
-                    columns[self.get_col_for(columns, stat)] = '0' if val[idx] == "NF" else val[idx]
-            self.lines[line_num - 1] = columns
+            ent_type_set = self.get_ent_type(columns)
+            cols = stats_cols_for_type.get(ent_type_set)
+            if cols is None:
+                cols = (self.get_col_for(columns, "NAME"), [(self.get_col_for(columns, stat), idx) for idx, stat in enumerate(stats_names)])
+                stats_cols_for_type[ent_type_set] = cols
+            name_col, stat_cols = cols
+            val = stats.pop(columns[name_col], None)
+            if val is not None:
+                for col, idx in stat_cols:
+                    columns[col] = '0' if val[idx] == "NF" else val[idx]
         
         del stats
 
@@ -552,72 +664,88 @@ class KnowledgeBase:
             return
 
         
-        # computing statistics
-        for line_num in range(1, len(self.lines) + 1):
+        # computing statistics (values of each row are kept for computing the scores)
+        type_codes = {} # Slovník frozenset(ENTITY_TYPE_SET):int(CODE), typy entit kódované malými čísly
+        row_type_codes = array.array('q')
+        row_has_wiki = array.array('b')
+        row_values = array.array('q') # columns_number a description_length za sebou pro každý řádek KB
+        row_wiki_values = []
+        lines_count = len(self.lines)
+        for line_num, columns in enumerate(self.lines, 1):
             self.show_progress(
                 val=line_num,
-                max=len(self.lines),
+                max=lines_count,
                 interval=10000,
                 message="Computing stats... ",
                 end_message="Statistics computed."
                 )
-            ent_type_set = self.get_ent_type(line_num)
-            ent_type_set_index = repr(set(ent_type_set)) # using normal set for indexing because {1,3,2} == {1,2,3} but OrderedSet([1,3,2]) != OrderedSet([1,2,3])
-            self.metrics.setdefault(ent_type_set_index, {})
-            self.metrics[ent_type_set_index].setdefault('columns_number', []).append(self.nonempty_columns(line_num))
-            self.metrics[ent_type_set_index].setdefault('description_length', []).append(self.description_length(line_num))
-            if self.get_wiki_value(line_num, 'backlinks'):
-                self.metrics[ent_type_set_index].setdefault('wiki_backlinks', []).append(int(self.get_wiki_value(line_num, 'backlinks')))
-                self.metrics[ent_type_set_index].setdefault('wiki_hits', []).append(int(self.get_wiki_value(line_num, 'hits')))
-                self.metrics[ent_type_set_index].setdefault('wiki_ps', []).append(int(self.get_wiki_value(line_num, 'ps')))
-
-        # sorting statistics
-        for i in self.metrics:
-            for j in self.metrics[i]:
-                self.metrics[i][j].sort()
-
-        # indexing statistics
-        for i in self.metrics:
-            for j in self.metrics[i]:
-                for k in range(0, len(self.metrics[i][j])):
-                    if self.metrics[i][j][k] not in self.metric_index.setdefault(i, {}).setdefault(j, {}):
-                        max_value = float(self.metrics[i][j][-1])
-                        if j in ['wiki_backlinks', 'wiki_hits']:
-                            max_value = 0.25 * max_value
-                        if max_value:
-                            normalized_value = float(self.metrics[i][j][k]) / max_value
-                            self.metric_index[i][j][self.metrics[i][j][k]] = min(normalized_value, 1.0)
-                        else:
-                            self.metric_index[i][j][self.metrics[i][j][k]] = 1.0
+            ent_type_set = self.get_ent_type(columns)
+            ent_type_set_index = self._ent_type_set_index(ent_type_set)
+            row_type_codes.append(type_codes.setdefault(ent_type_set_index, len(type_codes)))
+            row_values.append(self.nonempty_columns(columns))
+            row_values.append(self.description_length(columns))
+            has_wiki = bool(self.get_wiki_raw(columns, ent_type_set, "WIKI BACKLINKS"))
+            row_has_wiki.append(has_wiki)
+            # wiki stats are converted to integers at once below
+            row_wiki_values.append([self.get_wiki_raw(columns, ent_type_set, stat) for stat in stats_names] if has_wiki else ['0', '0', '0'])
+
+        self._row_type_codes = numpy.frombuffer(row_type_codes, dtype=numpy.int64)
+        self._row_has_wiki = numpy.frombuffer(row_has_wiki, dtype=numpy.int8).astype(bool)
+        self._row_stats = numpy.empty((lines_count, len(percentile_metrics)), dtype=numpy.int64) # Matice řádek KB x percentile_metrics
+        self._row_stats[:, :2] = numpy.frombuffer(row_values, dtype=numpy.int64).reshape(-1, 2)
+        self._row_stats[:, 2:] = numpy.array(row_wiki_values, dtype=str).astype(numpy.int64)
+        del row_type_codes, row_has_wiki, row_values, row_wiki_values
+
+        # sorting statistics of each entity type set and finding their maximal values
+        for ent_type_set_index, code in type_codes.items():
+            type_rows = self._row_type_codes == code
+            wiki_rows = type_rows & self._row_has_wiki
+            for k, metric in enumerate(percentile_metrics):
+                rows = wiki_rows if metric[0:4] == 'wiki' else type_rows
+                if not rows.any():
+                    continue
+                values = numpy.sort(self._row_stats[rows, k])
+                self.metrics.setdefault(ent_type_set_index, {})[metric] = values
+                max_value = float(values[-1])
+                if metric in ['wiki_backlinks', 'wiki_hits']:
+                    max_value = 0.25 * max_value
+                self.metrics_max.setdefault(ent_type_set_index, {})[metric] = max_value
+
+        # computing percentiles of all rows (each value divided by the maximal value for the entity type set, at most 1.0)
+        max_values = numpy.zeros((len(type_codes), len(percentile_metrics)), dtype=numpy.float64)
+        for ent_type_set_index, code in type_codes.items():
+            for k, metric in enumerate(percentile_metrics):
+                max_values[code, k] = self.metrics_max[ent_type_set_index].get(metric, 0.0)
+        row_max_values = max_values[self._row_type_codes]
+        percentiles = numpy.ones(self._row_stats.shape, dtype=numpy.float64)
+        numpy.divide(self._row_stats, row_max_values, out=percentiles, where=row_max_values != 0)
+        numpy.minimum(percentiles, 1.0, out=percentiles)
+        del row_max_values
+        columns_number, description_length, wiki_backlinks, wiki_hits, wiki_ps = percentiles.T
 
         # computing SCORE WIKI, SCORE METRICS and CONFIDENCE
-        for line_num in range(1, len(self.lines) + 1):
+        score_wiki = numpy.where(self._row_has_wiki, 100 * ((5 * wiki_backlinks + 5 * wiki_hits + wiki_ps) / 11), 0.0) # weighted average with weights 5, 5, 1
+        score_metrics = 100 * ((description_length + columns_number) / 2)
+        confidence = (5 * score_wiki + score_metrics) / 6 # weighted average with weights 5, 1
+        scores = numpy.char.mod("%.2f", numpy.stack([score_wiki, score_metrics, confidence], axis=1)).tolist()
+        del percentiles, score_wiki, score_metrics, confidence
+
+        # adding SCORE WIKI, SCORE METRICS and CONFIDENCE to the KB
+        score_cols_for_type = {} # Slovník str(TYPE):tuple(int(COLUMN), ...), sloupce metrics_names
+        for line_num, (columns, line_scores) in enumerate(zip(self.lines, scores), 1):
             self.show_progress(
                 val=line_num,
-                max=len(self.lines),
+                max=lines_count,
                 interval=10000,
                 message="Computing metrics... ",
                 end_message="Metrics computed."
                 )
-            columns = self.lines[line_num - 1]
-            
-            # computing SCORE WIKI
-            score_wiki = 0
-            if self.get_wiki_value(columns, 'backlinks'):
-                wiki_backlinks = self.metric_percentile(columns, 'wiki_backlinks')
-                wiki_hits = self.metric_percentile(columns, 'wiki_hits')
-                wiki_ps = self.metric_percentile(columns, 'wiki_ps')
-                score_wiki = 100 * numpy.average([wiki_backlinks, wiki_hits, wiki_ps], weights=[5, 5, 1])
-            columns[self.get_col_for(columns, "SCORE WIKI")] = "%.2f" % score_wiki
-
-            # computing SCORE METRICS
-            description_length = self.metric_percentile(columns, 'description_length')
-            columns_number = self.metric_percentile(columns, 'columns_number')
-            score_metrics = 100 * numpy.average([description_length, columns_number])
-            columns[self.get_col_for(columns, "SCORE METRICS")] = "%.2f" % score_metrics
-
-            # computing CONFIDENCE
-            columns[self.get_col_for(columns, "CONFIDENCE")] = "%.2f" % numpy.average([score_wiki, score_metrics], weights=[5, 1])
+            score_cols = score_cols_for_type.get(columns[self.ent_type_col])
+            if score_cols is None:
+                score_cols = tuple(self.get_col_for(columns, metric) for metric in metrics_names)
+                score_cols_for_type[columns[self.ent_type_col]] = score_cols
+            col_wiki, col_metrics, col_confidence = score_cols
+            columns[col_wiki], columns[col_metrics], columns[col_confidence] = line_scores
         
         if save_changes:
             self.save_changes()
@@ -626,29 +754,26 @@ class KnowledgeBase:
         # Add '+stats' to filename
         if not output_file:
             file_path = os.path.dirname(os.path.abspath(self.path_to_kb))
-            file_name = os.path.basename(os.path.abspath(self.path_to_kb))
-            file_extension = file_name.split(".")[-1]
-            file_name = "".join(file_name.split(".")[:-1])
+            file_name, file_extension = os.path.splitext(os.path.basename(os.path.abspath(self.path_to_kb)))
             if not file_extension:
-                file_extension = "tsv"
+                file_extension = ".tsv"
             
             file_name += "+stats"
-            output_file = f"{file_path}/{file_name}.{file_extension}"
+            output_file = f"{file_path}/{file_name}{file_extension}"
 
         # Make all dirs in output path if necessary
         if os.path.dirname(output_file):
             os.makedirs(os.path.dirname(output_file), exist_ok=True)
 
         print("saving changes to ", output_file)
-        with open(output_file, "w") as out_file:
+        with open(output_file, "w", buffering=1<<20) as out_file:
             # Write KB version
             if self.version:
                 out_file.write(self.version + "\n")
                 
             # Save KB head
-            KB_lines = self.getKBLines(self.path_to_kb, KB_PART.HEAD)
             stats_added = False
-            for line in KB_lines:
+            for line in self._head_lines:
                 # Add new columns in __stats__ line (if new metrics were inserted)
                 if any("<__stats__>" in column for column in line):
                     out_file.write("<__stats__>" + "\t".join(self.headKB["__stats__"].keys()))
@@ -664,19 +789,28 @@ class KnowledgeBase:
             # head-data separator
             out_file.write("\n")
 
-            # Save KB data
-            for line in self.lines+[""]:
-                out_file.write("\t".join([str(val) for val in line]))
-                out_file.write("\n")
+            # Save KB data (+ empty line at the end)
+            self.write_to(out_file)
+            out_file.write("\n")
+
+    def write_to(self, fp, batch_size=65536):
+        """ Writes data lines of the KB to an opened file in batches of lines (without building the whole KB as one string). """
+        for start in range(0, len(self.lines), batch_size):
+            batch = self.lines[start:start + batch_size]
+            fp.write("\n".join([self._join_line(line) for line in batch]) + "\n")
+
+    @staticmethod
+    def _join_line(line):
+        """ Joins columns of a line by tabs, converting them to strings only when necessary. """
+        try:
+            return "\t".join(line)
+        except TypeError: # insert_stats stores int 0 into stats of articles missing in one of the stats files
+            return "\t".join([str(val) for val in line])
         
     def _str1(self):
-        return '\n'.join(['\t'.join(line) for line in self.lines+[""]])
-
-    def _str2(self):
-        result = ""
-        for line in self.lines:
-            result += '\t'.join(line) + '\n'
-        return result
+        if not self.lines:
+            return ""
+        return '\n'.join('\t'.join(line) for line in self.lines) + '\n'
 
     def __str__(self):
         return self._str1()